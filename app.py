@@ -1,51 +1,253 @@
 import streamlit as st
+import streamlit.components.v1 as components
+from streamlit_autorefresh import st_autorefresh
 import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
+import orjson
 import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import plotly.express as px
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import time
+import threading
+from collections import Counter
 
 # ---------- PAGE CONFIG ----------
 st.set_page_config(page_title="📈 Virtual Stock Market", layout="wide")
 
 # ---------- BACKEND URL ----------
 BACKEND = os.environ.get("BACKEND", "https://game-of-trades-vblh.onrender.com")
+def env_seconds(name, default):
+    value = float(os.environ.get(name, default))
+    if value <= 0:
+        raise ValueError(f"{name} must be a positive number of seconds, got {value}")
+    return value
+
+# Same variable the backend ticks prices on; set it on both services so reruns track the ticks.
+PRICE_UPDATE_INTERVAL = env_seconds("PRICE_UPDATE_INTERVAL", 10)
 
 # ---------- SESSION STATE ----------
-for key in ["team", "round_start", "paused", "pause_time"]:
-    if key not in st.session_state:
-        st.session_state[key] = False if key == "paused" else None
+SESSION_DEFAULTS = {"team": None, "last_fetch_ts": 0, "fetched": None}
+for key, value in SESSION_DEFAULTS.items():
+    st.session_state.setdefault(key, value)
+
+MAX_CHART_POINTS = 50  # biggest movers plotted in the 3D chart
+FETCH_MIN_INTERVAL = 2  # seconds; reruns sooner than this (widget clicks) reuse the last fetch
+STALE_MAX_AGE = 60  # seconds a last-good response may be served after an error
+# st.cache_data TTL (seconds) per backend endpoint; tune from the admin "Fetch cache hits" panel
+FETCH_TTLS = {"stocks": 2, "leaderboard": 2, "news": 300, "portfolio": 2, "round": 1}
 
-ROUND_DURATION = 30 * 60  # 30 minutes
+# ---------- HTML SNIPPETS ----------
+TIMER_HTML = "<h1 style='text-align:center; color:{color};'>⏱️ {mins:02d}:{secs:02d}</h1>"
+# Client-side countdown: the browser ticks every 250ms, so Python only reruns for data refreshes.
+LIVE_TIMER_HTML = """
+<h1 id="t" style="text-align:center; font-family:sans-serif; margin:0;"></h1>
+<script>
+const end = {end_ms};
+function tick() {{
+    const r = Math.max(0, Math.floor((end - Date.now()) / 1000));
+    const el = document.getElementById("t");
+    el.style.color = r <= 10 ? "red" : r <= 60 ? "orange" : "green";
+    el.innerText = r > 0
+        ? "⏱️ " + String(Math.floor(r / 60)).padStart(2, "0") + ":" + String(r % 60).padStart(2, "0")
+        : "⏹️ Trading round has ended!";
+}}
+tick();
+setInterval(tick, 250);
+</script>
+"""
+ROUND_ENDED_HTML = "<h2 style='text-align:center; color:red;'>⏹️ Trading round has ended!</h2>"
+WAITING_HTML = "<h3 style='text-align:center; color:orange;'>⌛ Waiting for round to start...</h3>"
+NEWS_CARD_HTML = """
+<div style='background-color:#fdfdfd;padding:10px;margin-bottom:8px;border-radius:8px;
+box-shadow:0 2px 6px rgba(0,0,0,0.1)'>
+    <b><a href="{url}" target="_blank">{title}</a></b><br>
+    <span style="color:gray;font-size:12px;">{t}</span>
+</div>
+"""
 
 # ---------- UTILITY FUNCTIONS ----------
+@st.cache_resource
+def get_session():
+    # One keep-alive pool shared by every rerun and session; Retry only covers idempotent GETs.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20,
+                          max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504]))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@st.cache_resource
+def _last_good_store():
+    # url -> (timestamp, body, etag) of the last successful response; survives reruns, shared by fetch threads
+    return {}, threading.Lock()
+
+@st.cache_resource
+def _fetch_stats():
+    # Per endpoint: "calls" to the cached fetch_* helpers, and "misses" that got past st.cache_data
+    # to a backend GET (ETag revalidations included); hits = calls - misses.
+    return {"calls": Counter(), "misses": Counter()}, threading.Lock()
+
+def count_fetch(kind, endpoint):
+    stats, lock = _fetch_stats()
+    with lock:
+        stats[kind][endpoint] += 1
+
+def counted(endpoint, fetch, *args):
+    # Call a cached fetch_* helper, recording the call so the admin panel can derive hit ratios.
+    count_fetch("calls", endpoint)
+    return fetch(*args)
+
 def safe_get(url, timeout=5):
+    last_good, lock = _last_good_store()
+    count_fetch("misses", url[len(BACKEND):].split("/")[1])
+    with lock:
+        ts, body, etag = last_good.get(url, (0, None, None))
     try:
-        r = requests.get(url, timeout=timeout)
+        headers = {"If-None-Match": etag} if etag and body is not None else None
+        r = get_session().get(url, timeout=timeout, headers=headers)
+        if 400 <= r.status_code < 500:
+            return None  # a 404/409 is the backend's answer, not an outage; don't mask it with stale data
         r.raise_for_status()
-        return r.json()
-    except:
-        return None
+        if r.status_code != 304:  # 304: backend says our stored body is still current
+            body, etag = orjson.loads(r.content), r.headers.get("ETag")
+    except (RequestException, orjson.JSONDecodeError):
+        return body if time.time() - ts < STALE_MAX_AGE else None
+    with lock:
+        last_good[url] = (time.time(), body, etag)
+    return body
+
+@st.cache_data(ttl=FETCH_TTLS["round"], show_spinner=False)
+def fetch_round(): return safe_get(f"{BACKEND}/round")
 
+@st.cache_data(ttl=FETCH_TTLS["stocks"], show_spinner=False)
 def fetch_stocks(): return safe_get(f"{BACKEND}/stocks")
+
+@st.cache_data(ttl=FETCH_TTLS["leaderboard"], show_spinner=False)
 def fetch_leaderboard(): return safe_get(f"{BACKEND}/leaderboard")
+
+@st.cache_data(ttl=FETCH_TTLS["news"], show_spinner=False)
 def fetch_news(): return safe_get(f"{BACKEND}/news")
+
+@st.cache_data(ttl=FETCH_TTLS["portfolio"], show_spinner=False)
 def fetch_portfolio(team): return safe_get(f"{BACKEND}/portfolio/{team}")
 
-def init_team(team):
+@st.cache_resource
+def get_executor():
+    # Long-lived workers so a rerun doesn't pay thread start-up for every fetch batch. Every session
+    # shares this pool, so it matches the HTTP pool (pool_maxsize=20) rather than one rerun's three
+    # GETs; with only a few workers, a slow backend queues every user's rerun behind stuck fetches.
+    return ThreadPoolExecutor(max_workers=20, thread_name_prefix="fetch")
+
+def fetch_all(team):
+    # Independent GETs, so overlap them: a refresh costs the slowest call, not the sum.
+    ex = get_executor()
+    futs = {"stocks": ex.submit(counted, "stocks", fetch_stocks), "news": ex.submit(counted, "news", fetch_news),
+            "portfolio": ex.submit(counted, "portfolio", fetch_portfolio, team)}
+    return {k: f.result() for k, f in futs.items()}
+
+@st.cache_data(ttl=2, show_spinner=False)
+def _holdings_df(holdings):
+    return pd.DataFrame.from_dict(holdings, orient="index")
+
+@st.cache_data(ttl=5, show_spinner=False)
+def build_stock_views(stock_rows):
+    # Keyed on (symbol, name, price, pct_change) rows so unchanged prices reuse the table and figure.
+    df = pd.DataFrame(stock_rows, columns=["symbol", "name", "price", "pct_change"])
+    df["Trend"] = np.where(df["pct_change"].to_numpy() >= 0, "🟢", "🔴")
+    stocks_tbl = pa.table({"Symbol": df["symbol"], "Company": df["name"], "Price": df["price"],
+                           "% Change": df["pct_change"], "Trend": df["Trend"]})
+    # 3D chart
+    df['volume'] = np.arange(1, len(df)+1, dtype=np.int64) * 1000
+    plot_df = df.reindex(df['pct_change'].abs().sort_values(ascending=False).index[:MAX_CHART_POINTS])
+    fig3d = px.scatter_3d(plot_df, x='price', y='pct_change', z='volume', color='Trend',
+                          hover_name='name', size='price', size_max=18, opacity=0.8)
+    fig3d.update_traces(marker=dict(line=dict(width=1,color='DarkSlateGrey')))
+    fig3d.update_layout(scene=dict(xaxis_title="Price", yaxis_title="% Change", zaxis_title="Volume"),
+                        margin=dict(l=0,r=0,b=0,t=30))
+    return stocks_tbl, fig3d
+
+TOP3_CSS = np.array(['background-color: gold; font-weight:bold',
+                     'background-color: silver; font-weight:bold',
+                     'background-color: #cd7f32; font-weight:bold'], dtype=object)
+
+def highlight_top3(df):
+    # Whole-frame styler: one CSS matrix instead of a Python call per row.
+    css = np.full(df.shape, '', dtype=object)
+    top = min(len(df), len(TOP3_CSS))
+    css[:top, :] = TOP3_CSS[:top, None]
+    return pd.DataFrame(css, index=df.index, columns=df.columns)
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+def safe_post(url, payload, timeout=5, headers=None):
     try:
-        r = requests.post(f"{BACKEND}/init_team", json={"team": team})
-        if r.status_code == 200: return r.json()
-    except: return None
+        r = get_session().post(url, data=orjson.dumps(payload), headers={**JSON_HEADERS, **(headers or {})},
+                               timeout=timeout)
+        if r.status_code == 200: return orjson.loads(r.content)
+    except (RequestException, orjson.JSONDecodeError): return None
     return None
 
-def trade(team, symbol, qty):
+def init_team(team): return safe_post(f"{BACKEND}/init_team", {"team": team})
+def trade(team, symbol, qty): return safe_post(f"{BACKEND}/trade", {"team": team, "symbol": symbol, "qty": qty})
+
+@st.cache_data(ttl=60, show_spinner=False)
+def is_organizer(password):
+    # The backend is the only judge of the organizer password; a 403 just means "not an organizer".
     try:
-        r = requests.post(f"{BACKEND}/trade", json={"team": team, "symbol": symbol, "qty": qty})
-        if r.status_code == 200: return r.json()
-    except: return None
-    return None
+        r = get_session().get(f"{BACKEND}/organizer", headers={"X-Organizer-Token": password}, timeout=5)
+    except RequestException:
+        return False
+    return r.status_code == 200
+
+def round_action(action, password):
+    res = safe_post(f"{BACKEND}/round/{action}", {}, headers={"X-Organizer-Token": password})
+    fetch_round.clear()
+    return res
+
+ROUND_ACTION_STATUS = {"start": "running", "pause": "paused", "resume": "running", "reset": "waiting"}
+
+def report_round_action(action, password, notify, msg):
+    # The backend always answers with the current state, so check it actually landed where asked.
+    res = round_action(action, password)
+    if res is None:
+        st.error("❌ Round control failed. Check the organizer password.")
+    elif res["status"] != ROUND_ACTION_STATUS[action]:
+        st.warning(f"Round is {res['status']}; {action} had no effect.")
+    else:
+        notify(msg)
+
+def round_remaining(rnd):
+    # Seconds left in the shared round (frozen while paused), or None before it has started.
+    if not rnd or rnd["status"] == "waiting":
+        return None
+    if rnd["status"] == "running":
+        return max(0, rnd["end_ts"] - time.time())
+    return rnd["remaining"]
+
+TRADE_MESSAGES = {"buy": ("✅ Bought {qty} of {symbol}", "❌ Buy failed! Check cash balance."),
+                  "sell": ("✅ Sold {qty} of {symbol}", "❌ Sell failed! Check holdings.")}
+
+def submit_trade(side):
+    # Form callback: runs before the script body, so this same rerun renders the post-trade portfolio.
+    rnd = counted("round", fetch_round)
+    if not rnd or rnd["status"] != "running":
+        st.session_state.trade_feedback = ("error", "❌ Trading is closed: the round is not running.")
+        return
+    symbol, qty = st.session_state.trade_symbol, int(st.session_state.trade_qty)
+    ok_msg, fail_msg = TRADE_MESSAGES[side]
+    if trade(st.session_state.team, symbol, qty if side == "buy" else -qty):
+        fetch_portfolio.clear()
+        fetch_leaderboard.clear()
+        st.session_state.last_fetch_ts = 0
+        st.session_state.trade_feedback = ("success", ok_msg.format(qty=qty, symbol=symbol))
+    else:
+        st.session_state.trade_feedback = ("error", fail_msg)
 
 # ---------- TEAM REGISTRATION ----------
 if st.session_state.team is None:
@@ -59,7 +261,7 @@ if st.session_state.team is None:
                 st.success(f"Team '{team_name_input}' created with ₹{res['cash']:.2f}")
                 st.stop()
             else:
-                port = fetch_portfolio(team_name_input)
+                port = counted("portfolio", fetch_portfolio, team_name_input)
                 if port:
                     st.session_state.team = team_name_input
                     st.info(f"Team '{team_name_input}' logged in successfully.")
@@ -70,10 +272,31 @@ if st.session_state.team is None:
 
 team_name = st.session_state.team
 
+# ---------- AUTO REFRESH ----------
+# One linear pass per tick; Streamlit reruns the script instead of a blocking loop holding the thread.
+# Follows the backend's price tick; the timer runs in the browser and the leaderboard in its own fragment.
+st_autorefresh(interval=int(PRICE_UPDATE_INTERVAL * 1000), key="refresh")
+
 # ---------- ORGANIZER PASSWORD ----------
 st.sidebar.subheader("🔐 Organizer Access")
 password = st.sidebar.text_input("Enter Organizer Password", type="password")
-is_admin = password == "admin123"
+is_admin = bool(password) and is_organizer(password)
+if password and not is_admin:
+    st.sidebar.error("Not an organizer password.")
+
+# ---------- CACHE OBSERVABILITY ----------
+if is_admin:
+    with st.sidebar.expander("📊 Fetch cache hits"):
+        stats, stats_lock = _fetch_stats()
+        with stats_lock:
+            calls, misses = dict(stats["calls"]), dict(stats["misses"])
+        report = {}
+        for ep, ttl in FETCH_TTLS.items():
+            n, miss = calls.get(ep, 0), misses.get(ep, 0)
+            hits = n - miss
+            report[ep] = {"ttl": ttl, "calls": n, "hits": hits, "misses": miss,
+                          "hit_ratio": round(hits / n, 2) if n else None}
+        st.json(report)
 
 # ---------- ORGANIZER CONTROLS ----------
 if is_admin:
@@ -81,56 +304,46 @@ if is_admin:
         col1, col2, col3 = st.columns(3)
         with col1:
             if st.button("▶️ Start Round"):
-                st.session_state.round_start = time.time()
-                st.session_state.paused = False
-                st.success("✅ Round started.")
+                report_round_action("start", password, st.success, "✅ Round started.")
         with col2:
             if st.button("⏸ Pause Round"):
-                if st.session_state.round_start and not st.session_state.paused:
-                    st.session_state.paused = True
-                    st.session_state.pause_time = time.time()
-                    st.info("⏸ Round paused.")
+                report_round_action("pause", password, st.info, "⏸ Round paused.")
         with col3:
             if st.button("🔄 Resume Round"):
-                if st.session_state.paused:
-                    paused_duration = time.time() - st.session_state.pause_time
-                    st.session_state.round_start += paused_duration
-                    st.session_state.paused = False
-                    st.success("▶️ Round resumed.")
+                report_round_action("resume", password, st.success, "▶️ Round resumed.")
         if st.button("♻️ Reset Round"):
-            st.session_state.round_start = None
-            st.session_state.paused = False
-            st.session_state.pause_time = 0
-            st.warning("Round reset. You must start again.")
+            report_round_action("reset", password, st.warning, "Round reset. You must start again.")
 
 # ---------- TIMER ----------
 timer_placeholder = st.empty()
-trading_allowed = False
-if st.session_state.round_start:
-    elapsed = (st.session_state.pause_time - st.session_state.round_start) if st.session_state.paused else (time.time() - st.session_state.round_start)
-    remaining = max(0, ROUND_DURATION - elapsed)
+rnd = counted("round", fetch_round)
+remaining = round_remaining(rnd)  # same snapshot as rnd, so the branches below agree
+if remaining is None:
+    timer_placeholder.markdown(WAITING_HTML, unsafe_allow_html=True)
+elif remaining > 0 and rnd["status"] == "paused":
     mins, secs = divmod(int(remaining), 60)
     color = "red" if remaining <= 10 else "orange" if remaining <= 60 else "green"
-    if remaining > 0:
-        trading_allowed = True
-        timer_placeholder.markdown(f"<h1 style='text-align:center; color:{color};'>⏱️ {mins:02d}:{secs:02d}</h1>", unsafe_allow_html=True)
-    else:
-        timer_placeholder.markdown("<h2 style='text-align:center; color:red;'>⏹️ Trading round has ended!</h2>", unsafe_allow_html=True)
+    timer_placeholder.markdown(TIMER_HTML.format(color=color, mins=mins, secs=secs), unsafe_allow_html=True)
+elif remaining > 0:
+    with timer_placeholder.container():
+        components.html(LIVE_TIMER_HTML.format(end_ms=int(rnd["end_ts"] * 1000)), height=70)
 else:
-    timer_placeholder.markdown("<h3 style='text-align:center; color:orange;'>⌛ Waiting for round to start...</h3>", unsafe_allow_html=True)
+    timer_placeholder.markdown(ROUND_ENDED_HTML, unsafe_allow_html=True)
 
 # ---------- FETCH DATA ----------
-stocks = fetch_stocks()
-leaderboard = fetch_leaderboard()
-news = fetch_news()
-portfolio = fetch_portfolio(team_name)
+now = time.time()
+if st.session_state.fetched is None or now - st.session_state.last_fetch_ts >= FETCH_MIN_INTERVAL:
+    st.session_state.fetched = fetch_all(team_name)
+    st.session_state.last_fetch_ts = now
+data = st.session_state.fetched
+stocks, news, portfolio = data["stocks"], data["news"], data["portfolio"]
 
 # ---------- PORTFOLIO ----------
 st.subheader("💼 Portfolio")
 if portfolio:
     st.metric("Available Cash", f"₹{portfolio['cash']:.2f}")
     if portfolio.get("holdings"):
-        holdings_df = pd.DataFrame.from_dict(portfolio["holdings"], orient="index")
+        holdings_df = _holdings_df(portfolio["holdings"])
         st.dataframe(holdings_df, use_container_width=True)
     else:
         st.info("No holdings yet. Buy some stocks!")
@@ -138,62 +351,41 @@ if portfolio:
 # ---------- TRADE SECTION ----------
 st.subheader("💸 Place Trade")
 if stocks:
-    col1, col2, col3, col4 = st.columns([2,2,1,1])
-    with col1: selected_stock = st.selectbox("Select Stock", [s["symbol"] for s in stocks])
-    with col2: qty = st.number_input("Quantity", min_value=1, step=1, value=1)
-    with col3:
-        if st.button("Buy") and trading_allowed:
-            res = trade(team_name, selected_stock, int(qty))
-            if res:
-                st.success(f"✅ Bought {qty} of {selected_stock}")
-                portfolio = fetch_portfolio(team_name)  # REFRESH PORTFOLIO
-            else:
-                st.error("❌ Buy failed! Check cash balance.")
-    with col4:
-        if st.button("Sell") and trading_allowed:
-            res = trade(team_name, selected_stock, -int(qty))
-            if res:
-                st.success(f"✅ Sold {qty} of {selected_stock}")
-                portfolio = fetch_portfolio(team_name)  # REFRESH PORTFOLIO
-            else:
-                st.error("❌ Sell failed! Check holdings.")
+    symbols = tuple(s["symbol"] for s in stocks)
+    with st.form("trade_form"):
+        col1, col2, col3, col4 = st.columns([2,2,1,1])
+        with col1: st.selectbox("Select Stock", symbols, key="trade_symbol")
+        with col2: st.number_input("Quantity", min_value=1, step=1, value=1, key="trade_qty")
+        with col3: st.form_submit_button("Buy", on_click=submit_trade, args=("buy",))
+        with col4: st.form_submit_button("Sell", on_click=submit_trade, args=("sell",))
+    feedback = st.session_state.pop("trade_feedback", None)
+    if feedback:
+        kind, msg = feedback
+        getattr(st, kind)(msg)
 
 # ---------- STOCK DISPLAY ----------
 st.subheader("📊 Live Stock Prices")
 if stocks:
-    df = pd.DataFrame(stocks)
-    df["Trend"] = df["pct_change"].apply(lambda x: "🟢" if x >= 0 else "🔴")
-    st.dataframe(df[["symbol","name","price","pct_change","Trend"]]
-                 .rename(columns={"symbol":"Symbol","name":"Company","price":"Price","pct_change":"% Change"}), use_container_width=True)
-    # 3D chart
-    df['volume'] = [i*1000 for i in range(1,len(df)+1)]
-    fig3d = px.scatter_3d(df, x='price', y='pct_change', z='volume', color='Trend',
-                          hover_name='name', size='price', size_max=18, opacity=0.8)
-    fig3d.update_traces(marker=dict(line=dict(width=1,color='DarkSlateGrey')))
-    fig3d.update_layout(scene=dict(xaxis_title="Price", yaxis_title="% Change", zaxis_title="Volume"),
-                        margin=dict(l=0,r=0,b=0,t=30))
+    stocks_tbl, fig3d = build_stock_views(tuple((s["symbol"], s["name"], s["price"], s["pct_change"]) for s in stocks))
+    st.dataframe(stocks_tbl, use_container_width=True)
     st.plotly_chart(fig3d, use_container_width=True)
 
 # ---------- LEADERBOARD ----------
 st.subheader("🏆 Live Leaderboard")
-if leaderboard:
-    ldf = pd.DataFrame(leaderboard).sort_values("value",ascending=False).reset_index(drop=True)
-    ldf.index += 1
-    def highlight_top3(row):
-        if row.name==1: return ['background-color: gold; font-weight:bold']*len(row)
-        elif row.name==2: return ['background-color: silver; font-weight:bold']*len(row)
-        elif row.name==3: return ['background-color: #cd7f32; font-weight:bold']*len(row)
-        else: return ['']*len(row)
-    st.dataframe(ldf.style.apply(highlight_top3, axis=1), use_container_width=True, hide_index=False)
+
+@st.fragment(run_every="5s")
+def render_leaderboard():
+    leaderboard = counted("leaderboard", fetch_leaderboard)
+    if leaderboard:
+        ldf = pd.DataFrame(leaderboard)  # backend returns rows already ranked (ORDER BY value DESC)
+        ldf.index += 1
+        st.dataframe(ldf.style.apply(highlight_top3, axis=None), use_container_width=True, hide_index=False)
+
+render_leaderboard()
 
 # ---------- MARKET NEWS ----------
 st.subheader("📰 Market News")
 if news and "articles" in news and news["articles"]:
-    for article in news["articles"]:
-        st.markdown(f"""
-        <div style='background-color:#fdfdfd;padding:10px;margin-bottom:8px;border-radius:8px;
-        box-shadow:0 2px 6px rgba(0,0,0,0.1)'>
-            <b><a href="{article['url']}" target="_blank">{article['title']}</a></b><br>
-            <span style="color:gray;font-size:12px;">{datetime.now().strftime('%H:%M:%S')}</span>
-        </div>
-        """, unsafe_allow_html=True)
+    now_str = datetime.now().strftime('%H:%M:%S')
+    html = "".join(NEWS_CARD_HTML.format(url=a['url'], title=a['title'], t=now_str) for a in news["articles"])
+    st.markdown(html, unsafe_allow_html=True)
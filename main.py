@@ -1,26 +1,97 @@
 import asyncio
+import hmac
 import random
 import time
 from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
 import sqlite3
 import threading
+from contextlib import contextmanager
 import requests
 import os
 import json
+import orjson
 
-DB_FILE = "market.db"
+# Tunables, overridable from the environment so deployments don't need code edits.
+def env_seconds(name, default):
+    value = float(os.environ.get(name, default))
+    if value <= 0:
+        raise ValueError(f"{name} must be a positive number of seconds, got {value}")
+    return value
+
+DB_FILE = os.environ.get("DATABASE_PATH", "market.db")
+PRICE_UPDATE_INTERVAL = env_seconds("PRICE_UPDATE_INTERVAL", 10)  # seconds between price ticks
 app = FastAPI(title="Simulated Stock Market API")
 
 # ---------- ROUND STATE ----------
-ROUND_DURATION = 30 * 60  # 30 minutes
-ROUND_START = None
+# Round state and live prices (STOCK STATE below) live only in this process's memory, so the API
+# must run as a single worker: under `uvicorn --workers N` each worker would run its own round and
+# random walk, all writing to the same stocks table.
+ROUND_DURATION = env_seconds("ROUND_DURATION", 30 * 60)  # 30 minutes by default
+ROUND_START = None  # epoch the round started, shifted forward by time spent paused
+ROUND_PAUSED_AT = None
 ROUND_ACTIVE = False
+round_event = threading.Event()  # set while a round runs; the price updater blocks on it otherwise
+_round_lock = threading.Lock()
+# Shared secret for the /round control endpoints; unset means round control is disabled.
+ORGANIZER_TOKEN = os.environ.get("ORGANIZER_TOKEN", "")
 
 # ---------- DATABASE ----------
+_local = threading.local()
+
+def get_conn():
+    # One long-lived connection per thread (request workers, price updater); WAL lets readers
+    # run alongside the updater's writes.
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False, cached_statements=256)
+        conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+            PRAGMA cache_size=-65536;
+        """)
+        _local.conn = conn
+    return conn
+
+# Hot-path statements, kept as constants so each connection's statement cache parses them once.
+SQL_LEADERBOARD = """
+    SELECT t.name, t.cash + COALESCE(SUM(h.qty * s.price), 0) AS value
+    FROM teams t
+    LEFT JOIN holdings h ON h.team = t.name
+    LEFT JOIN stocks s ON s.symbol = h.symbol
+    GROUP BY t.name
+    ORDER BY value DESC
+"""
+SQL_PORTFOLIO = "SELECT t.cash, h.symbol, h.qty FROM teams t LEFT JOIN holdings h ON h.team = t.name WHERE t.name=?"
+SQL_TEAM_EXISTS = "SELECT 1 FROM teams WHERE name=?"
+SQL_BUY_DEBIT = "UPDATE teams SET cash = cash - ? WHERE name=? AND cash >= ?"
+SQL_BUY_UPSERT = """
+    INSERT INTO holdings (team, symbol, qty) VALUES (?, ?, ?)
+    ON CONFLICT(team, symbol) DO UPDATE SET qty = qty + excluded.qty
+"""
+SQL_SELL_DEBIT = "UPDATE holdings SET qty = qty - ? WHERE team=? AND symbol=? AND qty >= ?"
+SQL_SELL_PRUNE = "DELETE FROM holdings WHERE team=? AND symbol=? AND qty=0"
+SQL_SELL_CREDIT = "UPDATE teams SET cash = cash + ? WHERE name=?"
+SQL_UPDATE_PRICE = "UPDATE stocks SET price=?, pct_change=? WHERE symbol=?"
+
+@contextmanager
+def txn():
+    # BEGIN IMMEDIATE takes SQLite's write lock up front, so check-then-write sequences
+    # can't interleave with another writer; any exception rolls the whole thing back.
+    conn = get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn.cursor()
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_conn()
     c = conn.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS teams (
@@ -34,7 +105,7 @@ def init_db():
             symbol TEXT,
             qty INTEGER,
             PRIMARY KEY (team, symbol)
-        )
+        ) WITHOUT ROWID
     """)
     c.execute("""
         CREATE TABLE IF NOT EXISTS stocks (
@@ -45,7 +116,6 @@ def init_db():
         )
     """)
     conn.commit()
-    conn.close()
 
 # ---------- STOCK INITIALIZATION ----------
 STOCKS = [
@@ -60,37 +130,171 @@ STOCKS = [
 ]
 
 def seed_stocks():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    for s, name in STOCKS:
-        c.execute("INSERT OR IGNORE INTO stocks (symbol, name, price, pct_change) VALUES (?, ?, ?, ?)",
-                  (s, name, random.uniform(800, 2000), 0))
+    conn = get_conn()
+    conn.executemany("INSERT OR IGNORE INTO stocks (symbol, name, price, pct_change) VALUES (?, ?, ?, ?)",
+                     [(s, name, random.uniform(800, 2000), 0) for s, name in STOCKS])
     conn.commit()
-    conn.close()
 
-# ---------- UTILITIES ----------
-def get_stocks():
-    conn = sqlite3.connect(DB_FILE)
+# ---------- STOCK STATE ----------
+# Live prices are canonical in memory (hence one worker, see ROUND STATE); the updater copies them
+# to SQLite each tick so the leaderboard JOIN and restarts see the same values.
+_stocks_lock = threading.RLock()
+STOCK_STATE = {}  # symbol -> {"name", "price", "pct_change"}
+STOCKS_JSON = b"[]"  # /stocks body, re-encoded whenever STOCK_STATE changes so requests skip encoding
+STOCKS_VERSION = 0  # bumped on every publish; feeds the /stocks ETag
+
+def publish_stocks():
+    global STOCKS_JSON, STOCKS_VERSION
+    with _stocks_lock:
+        STOCKS_VERSION += 1
+        payload = [{"symbol": sym, "name": stock["name"], "price": round(stock["price"], 2),
+                    "pct_change": round(stock["pct_change"], 2)} for sym, stock in STOCK_STATE.items()]
+        STOCKS_JSON = orjson.dumps(payload)
+
+def load_stock_state():
+    conn = get_conn()
     c = conn.cursor()
     c.execute("SELECT symbol, name, price, pct_change FROM stocks")
-    rows = c.fetchall()
-    conn.close()
-    return [{"symbol": r[0], "name": r[1], "price": r[2], "pct_change": r[3]} for r in rows]
+    with _stocks_lock:
+        STOCK_STATE.clear()
+        for sym, name, price, pct_change in c.fetchall():
+            STOCK_STATE[sym] = {"name": name, "price": price, "pct_change": pct_change}
+        publish_stocks()
+
+def get_price(symbol):
+    with _stocks_lock:
+        stock = STOCK_STATE.get(symbol)
+        return stock["price"] if stock else None
+
+# ---------- RESPONSE CACHE ----------
+# Every client polls /leaderboard; serve a short-lived copy instead of querying per request.
+LEADERBOARD_TTL = 0.5
+_leaderboard_cache = {"ts": 0, "payload": None, "version": 0, "built": None}
+_cache_lock = threading.Lock()
+
+def cached(cache, ttl, build):
+    # Returns (payload, version); a payload is only reused if nothing invalidated it since it was built.
+    with _cache_lock:
+        if cache["built"] == cache["version"] and time.time() - cache["ts"] < ttl:
+            return cache["payload"], cache["built"]
+        version = cache["version"]
+    payload = build()
+    with _cache_lock:
+        cache["ts"], cache["payload"], cache["built"] = time.time(), payload, version
+    return payload, version
+
+def invalidate(*caches):
+    with _cache_lock:
+        for cache in caches:
+            cache["version"] += 1
+
+# ---------- ETAGS ----------
+_BOOT_ID = f"{time.time_ns():x}"  # keeps ETags from a previous process from ever matching
+
+def etag_for(kind, version):
+    return f'W/"{_BOOT_ID}-{kind}{version}"'
+
+def etag_response(request, etag, content, cache_control="no-cache"):
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type="application/json", headers=headers)
+
+# ---------- UTILITIES ----------
+def _load_leaderboard():
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute(SQL_LEADERBOARD)
+    return [{"team": name, "value": value} for name, value in c.fetchall()]
+
+def get_leaderboard():
+    # Cached as encoded bytes, so cache hits skip serialization as well as the query.
+    return cached(_leaderboard_cache, LEADERBOARD_TTL, lambda: orjson.dumps(_load_leaderboard()))
+
+def _set_active(active):
+    global ROUND_ACTIVE
+    ROUND_ACTIVE = active
+    if active:
+        round_event.set()
+    else:
+        round_event.clear()
+
+def _round_state():
+    # Caller holds _round_lock.
+    if ROUND_START is None:
+        return {"status": "waiting", "end_ts": None, "remaining": None, "duration": ROUND_DURATION}
+    end_ts = ROUND_START + ROUND_DURATION
+    remaining = max(0, end_ts - (ROUND_PAUSED_AT or time.time()))
+    status = "paused" if ROUND_PAUSED_AT else "running" if remaining > 0 else "ended"
+    return {"status": status, "end_ts": end_ts, "remaining": remaining, "duration": ROUND_DURATION}
+
+def round_state():
+    with _round_lock:
+        return _round_state()
+
+def start_round_state():
+    global ROUND_START, ROUND_PAUSED_AT
+    with _round_lock:
+        ROUND_START, ROUND_PAUSED_AT = time.time(), None
+        _set_active(True)
+
+def pause_round_state():
+    global ROUND_PAUSED_AT
+    with _round_lock:
+        if ROUND_ACTIVE:
+            ROUND_PAUSED_AT = time.time()
+            _set_active(False)
+
+def resume_round_state():
+    global ROUND_START, ROUND_PAUSED_AT
+    with _round_lock:
+        if ROUND_PAUSED_AT:
+            ROUND_START += time.time() - ROUND_PAUSED_AT
+            ROUND_PAUSED_AT = None
+            _set_active(True)
+
+def reset_round_state():
+    global ROUND_START, ROUND_PAUSED_AT
+    with _round_lock:
+        ROUND_START, ROUND_PAUSED_AT = None, None
+        _set_active(False)
 
 def update_stock_prices():
+    next_tick = time.monotonic()
     while True:
+        if not round_event.is_set():
+            round_event.wait()
+            next_tick = time.monotonic()  # a started/resumed round ticks immediately
+        state = round_state()
+        if state["status"] == "ended":
+            with _round_lock:
+                # Re-check under the lock: a /round/start may have landed since the read above.
+                if _round_state()["status"] == "ended":
+                    _set_active(False)
+            continue
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            # Sleep until the next scheduled tick, but wake at round end too so the round is
+            # deactivated on time. An early wake (end_ts moved by pause/resume or a restart)
+            # just loops back here without ticking or shifting the schedule.
+            if state["end_ts"] is not None:
+                delay = min(delay, state["end_ts"] - time.time())
+            time.sleep(max(0, delay))
+            continue
         if ROUND_ACTIVE:
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("SELECT symbol, price FROM stocks")
-            rows = c.fetchall()
-            for sym, price in rows:
-                change = random.uniform(-3, 3)
-                new_price = max(10, price * (1 + change / 100))
-                c.execute("UPDATE stocks SET price=?, pct_change=? WHERE symbol=?", (new_price, change, sym))
+            uniform, updates = random.uniform, []
+            with _stocks_lock:
+                for sym, stock in STOCK_STATE.items():
+                    pct = uniform(-3, 3)
+                    price = max(10, stock["price"] * (1 + pct / 100))
+                    stock["price"], stock["pct_change"] = price, pct
+                    updates.append((price, pct, sym))
+                publish_stocks()
+            conn = get_conn()
+            conn.executemany(SQL_UPDATE_PRICE, updates)
             conn.commit()
-            conn.close()
-        time.sleep(10)
+            invalidate(_leaderboard_cache)
+        next_tick += PRICE_UPDATE_INTERVAL  # fixed-rate schedule, so tick work doesn't add drift
 
 # ---------- API MODELS ----------
 class TradeRequest(BaseModel):
@@ -106,121 +310,138 @@ class InitTeam(BaseModel):
 def startup_event():
     init_db()
     seed_stocks()
+    load_stock_state()
     threading.Thread(target=update_stock_prices, daemon=True).start()
 
+def require_organizer(request):
+    if not ORGANIZER_TOKEN:
+        raise HTTPException(status_code=403, detail="Round control is disabled: ORGANIZER_TOKEN is not set")
+    # Compare bytes: compare_digest raises TypeError on non-ASCII str, which would surface as a 500.
+    if not hmac.compare_digest(request.headers.get("x-organizer-token", "").encode(), ORGANIZER_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid organizer token")
+
+# Endpoints below that never touch SQLite are async so they run on the event loop directly;
+# the DB-backed ones stay sync and FastAPI runs them in its threadpool.
+@app.get("/organizer")
+async def organizer(request: Request):
+    # Lets the frontend check an organizer password without changing anything.
+    require_organizer(request)
+    return {"organizer": True}
+
+@app.get("/round")
+async def get_round():
+    return round_state()
+
+@app.post("/round/start")
+async def start_round(request: Request):
+    require_organizer(request)
+    start_round_state()
+    return round_state()
+
+@app.post("/round/pause")
+async def pause_round(request: Request):
+    require_organizer(request)
+    pause_round_state()
+    return round_state()
+
+@app.post("/round/resume")
+async def resume_round(request: Request):
+    require_organizer(request)
+    resume_round_state()
+    return round_state()
+
+@app.post("/round/reset")
+async def reset_round(request: Request):
+    require_organizer(request)
+    reset_round_state()
+    return round_state()
+
 @app.get("/stocks")
-def stocks():
-    return get_stocks()
+async def stocks(request: Request):
+    with _stocks_lock:
+        body, version = STOCKS_JSON, STOCKS_VERSION
+    return etag_response(request, etag_for("s", version), body, cache_control="max-age=2")
 
 @app.post("/init_team")
 def init_team(data: InitTeam):
     team = data.team.strip()
     if not team:
         raise HTTPException(status_code=400, detail="Invalid team name")
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_conn()
     c = conn.cursor()
     c.execute("INSERT OR IGNORE INTO teams (name, cash) VALUES (?, ?)", (team, 100000))
     conn.commit()
     c.execute("SELECT cash FROM teams WHERE name=?", (team,))
     cash = c.fetchone()[0]
-    conn.close()
+    invalidate(_leaderboard_cache)
     return {"team": team, "cash": cash}
 
+def require_team(c, team):
+    c.execute(SQL_TEAM_EXISTS, (team,))
+    if not c.fetchone():
+        raise HTTPException(status_code=404, detail="Team not found")
+
 @app.post("/trade")
 def trade(data: TradeRequest):
     team, symbol, qty = data.team.strip(), data.symbol.strip(), int(data.qty)
     if qty == 0:
         raise HTTPException(status_code=400, detail="Quantity must not be zero")
-
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-
-    # Get stock price
-    c.execute("SELECT price FROM stocks WHERE symbol=?", (symbol,))
-    stock = c.fetchone()
-    if not stock:
-        conn.close()
+    if round_state()["status"] != "running":
+        raise HTTPException(status_code=409, detail="Round is not running")
+    # Prices live in memory, so validate the symbol before BEGIN IMMEDIATE takes the write lock.
+    price = get_price(symbol)
+    if price is None:
         raise HTTPException(status_code=404, detail="Stock not found")
-
-    price = stock[0]
     total = price * abs(qty)
 
-    # Get team info
-    c.execute("SELECT cash FROM teams WHERE name=?", (team,))
-    row = c.fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Team not found")
-    cash = row[0]
-
-    # --- BUY ---
-    if qty > 0:
-        if cash < total:
-            conn.close()
-            raise HTTPException(status_code=400, detail="Insufficient funds")
-        cash -= total
-        c.execute("UPDATE teams SET cash=? WHERE name=?", (cash, team))
-        c.execute("INSERT OR IGNORE INTO holdings (team, symbol, qty) VALUES (?, ?, 0)", (team, symbol))
-        c.execute("UPDATE holdings SET qty = qty + ? WHERE team=? AND symbol=?", (qty, team, symbol))
-
-    # --- SELL ---
-    else:
-        qty = abs(qty)
-        c.execute("SELECT qty FROM holdings WHERE team=? AND symbol=?", (team, symbol))
-        row = c.fetchone()
-        if not row or row[0] < qty:
-            conn.close()
-            raise HTTPException(status_code=400, detail="Not enough shares to sell")
-        new_qty = row[0] - qty
-        if new_qty == 0:
-            c.execute("DELETE FROM holdings WHERE team=? AND symbol=?", (team, symbol))
+    with txn() as c:
+        # --- BUY ---
+        if qty > 0:
+            # The balance check rides on the UPDATE itself; zero rows means no team or not enough cash.
+            c.execute(SQL_BUY_DEBIT, (total, team, total))
+            if c.rowcount == 0:
+                require_team(c, team)
+                raise HTTPException(status_code=400, detail="Insufficient funds")
+            c.execute(SQL_BUY_UPSERT, (team, symbol, qty))
+
+        # --- SELL ---
         else:
-            c.execute("UPDATE holdings SET qty=? WHERE team=? AND symbol=?", (new_qty, team, symbol))
-        cash += total
-        c.execute("UPDATE teams SET cash=? WHERE name=?", (cash, team))
+            qty = abs(qty)
+            # Same trick as the buy side: the share-count check rides on the UPDATE.
+            c.execute(SQL_SELL_DEBIT, (qty, team, symbol, qty))
+            if c.rowcount == 0:
+                require_team(c, team)
+                raise HTTPException(status_code=400, detail="Not enough shares to sell")
+            c.execute(SQL_SELL_PRUNE, (team, symbol))
+            c.execute(SQL_SELL_CREDIT, (total, team))
 
-    conn.commit()
-    conn.close()
+    invalidate(_leaderboard_cache)
     return {"success": True, "team": team, "symbol": symbol, "qty": qty}
 
 @app.get("/portfolio/{team}")
 def portfolio(team: str):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_conn()
     c = conn.cursor()
-    c.execute("SELECT cash FROM teams WHERE name=?", (team,))
-    row = c.fetchone()
-    if not row:
-        conn.close()
+    c.execute(SQL_PORTFOLIO, (team,))
+    rows = c.fetchall()
+    if not rows:
         raise HTTPException(status_code=404, detail="Team not found")
-    cash = row[0]
-    c.execute("SELECT symbol, qty FROM holdings WHERE team=?", (team,))
-    holdings = dict(c.fetchall())
-    conn.close()
-    return {"team": team, "cash": cash, "holdings": holdings}
+    holdings = {sym: qty for _, sym, qty in rows if sym is not None}
+    return {"team": team, "cash": rows[0][0], "holdings": holdings}
 
 @app.get("/leaderboard")
-def leaderboard():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT name, cash FROM teams")
-    teams = c.fetchall()
-
-    lb = []
-    for name, cash in teams:
-        c.execute("SELECT h.symbol, h.qty, s.price FROM holdings h JOIN stocks s ON h.symbol=s.symbol WHERE h.team=?", (name,))
-        total_value = sum(q * p for _, q, p in c.fetchall())
-        lb.append({"team": name, "value": cash + total_value})
+def leaderboard(request: Request):
+    body, version = get_leaderboard()
+    return etag_response(request, etag_for("l", version), body)
 
-    conn.close()
-    return sorted(lb, key=lambda x: x["value"], reverse=True)
+SAMPLE_NEWS = [
+    {"title": "Tech stocks surge amid AI breakthroughs", "url": "#"},
+    {"title": "Tesla shares jump after earnings beat", "url": "#"},
+    {"title": "Market shows resilience after global slowdown", "url": "#"},
+    {"title": "Analysts bullish on cloud computing sector", "url": "#"}
+]
 
 @app.get("/news")
-def news():
-    sample_news = [
-        {"title": "Tech stocks surge amid AI breakthroughs", "url": "#"},
-        {"title": "Tesla shares jump after earnings beat", "url": "#"},
-        {"title": "Market shows resilience after global slowdown", "url": "#"},
-        {"title": "Analysts bullish on cloud computing sector", "url": "#"}
-    ]
-    return {"articles": random.sample(sample_news, k=min(3, len(sample_news)))}
+async def news():
+    return {"articles": random.sample(SAMPLE_NEWS, k=min(3, len(SAMPLE_NEWS)))}
 